@@ -19,6 +19,8 @@ setup(
     ],
     install_requires=[
         'llama-index~=0.9.36',
+        'orjson~=3.9',
         'pydantic~=2.5.3',
-        'requests~=2.31.0'
+        'requests~=2.31.0',
+        'urllib3~=2.0'
     ],)
@@ -0,0 +1,322 @@
+import gc
+import threading
+import time
+import weakref
+from enum import Enum
+from typing import Any, Callable, Dict, List, Optional
+
+import orjson
+import pytest
+import requests
+from llama_index.callbacks.schema import CBEvent, CBEventType
+
+from trustwise.callback import TrustwiseCallbackHandler
+from trustwise.config import TW_LOG_EVENTS_BATCH_URL, TW_LOG_EVENTS_URL
+
+
+class FakeResponse:
+    def __init__(self, status_code: int = 200) -> None:
+        self.status_code = status_code
+
+    def raise_for_status(self) -> None:
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"{self.status_code} Error", response=self)
+
+
+class FakeSession:  # Stands in for the worker's requests.Session and records every POST
+    def __init__(self, status: Optional[Callable[[str, bytes], int]] = None) -> None:
+        self.posts: List[Dict[str, Any]] = []
+        self.status = status or (lambda url, data: 200)
+
+    def post(self, url: str, data: bytes, headers: Dict[str, str], timeout: Any) -> FakeResponse:
+        self.posts.append({"url": url, "data": data, "headers": headers})
+        return FakeResponse(self.status(url, data))
+
+    def close(self) -> None:
+        pass
+
+    def events(self, index: int) -> List[Dict[str, Any]]:
+        return orjson.loads(self.posts[index]["data"])["events"]
+
+
+def make_handler(session: Optional[FakeSession] = None, **kwargs: Any) -> TrustwiseCallbackHandler:
+    handler = TrustwiseCallbackHandler(
+        user_id="user", scan_name="scan", scan_id="scan-1", print_trace_on_end=False, **kwargs
+    )
+    handler._log_worker._session = session or FakeSession()
+    return handler
+
+
+class Color(str, Enum):
+    RED = "red"
+
+
+class DictPayload:  # Payload type serialized through its to_dict()
+    def __init__(self, data: Dict[Any, Any]) -> None:
+        self.data = data
+
+    def to_dict(self) -> Dict[Any, Any]:
+        return self.data
+
+
+def wait_for(condition: Callable[[], bool], timeout: float = 2.0) -> bool:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.005)
+    return True
+
+
+@pytest.fixture(autouse=True)
+def batch_supported(monkeypatch):
+    monkeypatch.setattr("trustwise.callback._batch_supported", True)  # Shared by every worker
+
+
+@pytest.fixture
+def handler():
+    handler = make_handler(project_id="project-1")
+    yield handler
+    handler.close()
+
+
+def test_posted_batch_round_trips_through_orjson(handler):
+    session = handler._log_worker._session
+    handler.start_trace("query")
+    handler.on_event_start(CBEventType.QUERY, payload={"text": 'quote " and é'}, event_id="a", parent_id="root")
+    handler.start_trace("index")
+    handler.on_event_end(CBEventType.QUERY, payload=None, event_id="a")
+    handler.flush()
+
+    assert len(session.posts) == 1
+    assert session.posts[0]["headers"] == {"Content-Type": "application/json"}
+    start, end = session.events(0)
+    assert start == {
+        "user_id": "user",
+        "scan_id": "scan-1",
+        "project_id": "project-1",
+        "scan_name": "scan",
+        "trace_type": "query",
+        "event_type": "QUERY",
+        "parent_id": "root",
+        "event_id": "a",
+        "event_time": start["event_time"],
+        "event_payload": "{'text': 'quote \" and é'}",
+    }
+    assert end["trace_type"] == "index"  # Each event keeps the prefix of the trace it fired in
+    assert end["parent_id"] == "a"
+    assert end["event_payload"] == "None"
+
+
+
+def test_payload_with_non_str_keys_is_logged(handler):
+    session = handler._log_worker._session
+    handler.start_trace("query")
+    handler.on_event_start(CBEventType.LLM, payload=DictPayload({1: "one", Color.RED: "red"}), event_id="a")
+    handler.on_event_start(CBEventType.LLM, payload=DictPayload({"big": 2 ** 70}), event_id="b")  # Beyond orjson
+    handler.on_event_start(CBEventType.LLM, payload=DictPayload({"ok": True}), event_id="c")
+    handler.flush()
+
+    events = session.events(0)
+    assert [event["event_id"] for event in events] == ["a", "c"]  # Only the event orjson rejects is dropped
+    assert events[0]["event_payload"] == {"1": "one", "red": "red"}
+    assert handler.dropped_events == 1
+
+
+@pytest.mark.parametrize("status_code", [404, 405])
+def test_missing_batch_endpoint_falls_back_to_single_events(status_code):
+    session = FakeSession(status=lambda url, data: status_code if url == TW_LOG_EVENTS_BATCH_URL else 200)
+    handler = make_handler(session=session, batch_size=100, flush_ms=60_000)
+    handler.start_trace("query")
+    handler.on_event_start(CBEventType.LLM, event_id="a")
+    handler.on_event_start(CBEventType.LLM, event_id="b")
+    handler.flush()
+    handler.on_event_start(CBEventType.LLM, event_id="c")
+    handler.flush()
+
+    # The batch endpoint is not tried again once it is known to be missing
+    assert [post["url"] for post in session.posts] == [TW_LOG_EVENTS_BATCH_URL] + [TW_LOG_EVENTS_URL] * 3
+    assert [orjson.loads(post["data"])["event_id"] for post in session.posts[1:]] == ["a", "b", "c"]
+    handler.close()
+
+
+def test_failed_single_event_does_not_stop_the_rest(monkeypatch, caplog):
+    monkeypatch.setattr("trustwise.callback._batch_supported", False)
+    session = FakeSession(status=lambda url, data: 422 if orjson.loads(data)["event_id"] == "1" else 200)
+    handler = make_handler(session=session, batch_size=100, flush_ms=60_000)
+    handler.start_trace("query")
+    for i in range(5):
+        handler.on_event_start(CBEventType.LLM, event_id=str(i))
+    handler.flush()
+
+    assert [orjson.loads(post["data"])["event_id"] for post in session.posts] == ["0", "1", "2", "3", "4"]
+    assert "Error logging event to MongoDB: 422 Error" in caplog.text
+    assert "4 events logged to MongoDB Successfully" in caplog.text
+    handler.close()
+
+
+def test_flush_after_timed_out_close_returns_at_once(caplog):
+    release = threading.Event()
+    session = FakeSession(status=lambda url, data: 200 if release.wait() else 500)  # Hangs until released
+    handler = make_handler(session=session, batch_size=1)
+    handler.start_trace("query")
+    handler.on_event_start(CBEventType.LLM, event_id="0")
+    assert wait_for(lambda: len(session.posts) == 1)  # Stuck in flight
+    handler.on_event_start(CBEventType.LLM, event_id="1")
+    handler.on_event_start(CBEventType.LLM, event_id="2")
+    handler.close(timeout=0.1)
+
+    started = time.monotonic()
+    handler.flush()
+    assert time.monotonic() - started < 0.5
+    assert "Dropping event logs not sent within 0.1 seconds - 2 queued" in caplog.text
+    assert "were not sent within" not in caplog.text
+    release.set()
+
+
+def test_batch_is_sent_once_full():
+    handler = make_handler(batch_size=3, flush_ms=60_000)
+    session = handler._log_worker._session
+    handler.start_trace("query")
+    for i in range(7):
+        handler.on_event_start(CBEventType.LLM, event_id=str(i))
+
+    assert wait_for(lambda: len(session.posts) == 2)
+    handler.flush()
+    assert [len(session.events(i)) for i in range(3)] == [3, 3, 1]
+    handler.close()
+
+
+def test_batch_is_sent_after_flush_ms():
+    handler = make_handler(batch_size=100, flush_ms=20)
+    session = handler._log_worker._session
+    handler.start_trace("query")
+    handler.on_event_start(CBEventType.LLM, event_id="a")
+    handler.on_event_start(CBEventType.LLM, event_id="b")
+
+    assert wait_for(lambda: len(session.posts) == 1)
+    assert [event["event_id"] for event in session.events(0)] == ["a", "b"]
+    handler.close()
+
+
+def test_flush_and_close_send_partial_batches():
+    handler = make_handler(batch_size=100, flush_ms=60_000)
+    session = handler._log_worker._session
+    handler.start_trace("query")
+    handler.on_event_start(CBEventType.LLM, event_id="a")
+    handler.flush()
+    assert len(session.events(0)) == 1
+
+    handler.on_event_start(CBEventType.LLM, event_id="b")
+    handler.close()
+    assert len(session.events(1)) == 1
+
+
+def test_events_after_close_are_ignored(handler):
+    handler.start_trace("query")
+    handler.close()
+    handler.on_event_start(CBEventType.LLM, event_id="a")
+
+    assert handler._log_worker._log_queue.qsize() == 0
+    assert handler._log_worker._session.posts == []
+    assert [event.id_ for event in handler.sequential_events] == ["a"]  # Still tracked in memory
+
+
+def test_unclosed_handler_is_collected_and_its_worker_stops():
+    handler = make_handler(batch_size=100, flush_ms=60_000)
+    session = handler._log_worker._session
+    handler.start_trace("query")
+    handler.on_event_start(CBEventType.LLM, event_id="a")
+    thread = handler._log_worker._thread
+    handler_ref = weakref.ref(handler)
+
+    del handler
+    gc.collect()
+    assert handler_ref() is None
+    assert wait_for(lambda: not thread.is_alive())
+    assert [event["event_id"] for event in session.events(0)] == ["a"]  # Pending events are still sent
+
+
+def test_event_time_info_uses_monotonic_stamps(monkeypatch):
+    handler = make_handler()
+    handler.logging_enabled = False  # Keeps the worker thread, which also reads the clock, from starting
+    stamps = iter([10.0, 11.0, 11.5, 12.5])
+    monkeypatch.setattr("trustwise.callback.time.monotonic", lambda: next(stamps))
+    handler.on_event_start(CBEventType.QUERY, event_id="query")
+    handler.on_event_start(CBEventType.LLM, event_id="llm")
+    handler.on_event_end(CBEventType.LLM, event_id="llm")
+    handler.on_event_end(CBEventType.QUERY, event_id="query")
+    monkeypatch.undo()
+
+    assert handler.get_event_time_info().total_secs == pytest.approx(3.0)
+    assert handler.get_event_time_info(CBEventType.LLM).total_secs == pytest.approx(0.5)
+    handler.close()
+
+
+def test_event_time_info_parses_timestamps_of_external_events():
+    handler = make_handler()
+    start = CBEvent(CBEventType.LLM, id_="external", time="01/02/2024, 10:00:00.000000")
+    end = CBEvent(CBEventType.LLM, id_="external", time="01/02/2024, 10:00:01.500000")
+
+    event_pairs = handler._get_event_pairs([start, end])
+    assert handler._get_time_stats_from_event_pairs(event_pairs).total_secs == pytest.approx(1.5)
+    handler.close()
+
+
+def test_event_pairs_are_ordered_by_start(monkeypatch):
+    handler = make_handler()
+    handler.logging_enabled = False
+    stamps = iter([1.0, 2.0, 3.0, 4.0])
+    monkeypatch.setattr("trustwise.callback.time.monotonic", lambda: next(stamps))
+    handler.on_event_start(CBEventType.QUERY, event_id="b")
+    handler.on_event_start(CBEventType.LLM, event_id="a")
+    handler.on_event_end(CBEventType.LLM, event_id="a")
+    handler.on_event_end(CBEventType.QUERY, event_id="b")
+    monkeypatch.undo()
+    b_start, a_start, a_end, b_end = handler.sequential_events
+
+    assert [pair[0].id_ for pair in handler.get_event_pairs()] == ["b", "a"]
+    assert [pair[0].id_ for pair in handler._get_event_pairs([a_end, b_start, a_start, b_end])] == ["b", "a"]
+
+    # Without monotonic stamps the parsed start timestamps decide the order
+    late = CBEvent(CBEventType.LLM, id_="late", time="01/02/2024, 10:00:05.000000")
+    early = CBEvent(CBEventType.LLM, id_="early", time="01/02/2024, 10:00:01.000000")
+    assert [pair[0].id_ for pair in handler._get_event_pairs([late, early, b_start])] == ["early", "late", "b"]
+    handler.close()
+
+
+def assert_tracking_in_step(handler: TrustwiseCallbackHandler) -> None:
+    events_by_id: Dict[str, List[CBEvent]] = {}
+    for event in handler.sequential_events:
+        events_by_id.setdefault(event.id_, []).append(event)
+    assert handler.events_pairs_by_id == events_by_id
+    assert {event_id: len(stamps) for event_id, stamps in handler._event_monotonic.items()} == {
+        event_id: len(events) for event_id, events in events_by_id.items()
+    }
+
+
+def test_bounded_history_evicts_oldest_events_everywhere(monkeypatch):
+    handler = make_handler(max_event_history=4)
+    handler.logging_enabled = False
+    stamps = iter(range(100))
+    monkeypatch.setattr("trustwise.callback.time.monotonic", lambda: float(next(stamps)))
+    # Interleaved starts and ends, with "a" starting again once its first pair has ended
+    for callback, event_id in [
+        (handler.on_event_start, "a"),
+        (handler.on_event_start, "b"),
+        (handler.on_event_end, "a"),
+        (handler.on_event_start, "a"),
+        (handler.on_event_end, "b"),
+        (handler.on_event_end, "a"),
+        (handler.on_event_start, "c"),
+    ]:
+        callback(CBEventType.LLM, event_id=event_id)
+        assert len(handler.sequential_events) <= 4
+        assert_tracking_in_step(handler)
+    monkeypatch.undo()
+
+    # The starts of "a" and "b" and the first end of "a" are gone
+    assert handler._event_monotonic == {"a": [3.0, 5.0], "b": [4.0], "c": [6.0]}
+    assert [pair[0].id_ for pair in handler.get_event_pairs()] == ["a", "b", "c"]
+    assert handler.get_event_time_info().total_secs == pytest.approx(2.0)  # Only "a" still has both ends
+    handler.close()
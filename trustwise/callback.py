@@ -1,10 +1,21 @@
+import asyncio
+import atexit
 import logging
+import operator
+import queue
+import threading
+import time
+import weakref
+import orjson
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from pydantic import ValidationError
 from trustwise.models import LoggingPayload
-from trustwise.config import TW_LOG_EVENTS_URL
+from trustwise.config import TW_LOG_EVENTS_BATCH_URL, TW_LOG_EVENTS_URL
 from datetime import datetime
-from collections import defaultdict
-from typing import Any, Dict, List, Optional
+from collections import defaultdict, deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Sequence, Tuple
 from llama_index.callbacks.base_handler import BaseCallbackHandler
 from llama_index.callbacks.schema import (
     BASE_TRACE_EVENT,
@@ -19,6 +30,255 @@ logging.basicConfig()  # Add logging level here if you plan on using logging.inf
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+_STOP = object()  # Sentinel telling the log worker to exit once the queue is drained
+_DRAIN_TIMEOUT_SECS = 5.0  # Default time flush/close (and interpreter exit) wait for pending event logs
+
+if TIMESTAMP_FORMAT in ("%Y-%m-%d %H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S.%f"):
+    _parse_ts = datetime.fromisoformat  # Much faster than strptime for ISO timestamps
+else:
+    def _parse_ts(ts: str, _strptime=datetime.strptime, _fmt: str = TIMESTAMP_FORMAT) -> datetime:
+        """Parse a CBEvent timestamp, with the strptime lookups bound as defaults."""
+        return _strptime(ts, _fmt)
+
+
+def _parse_ts_cached(ts: str, ts_cache: Dict[str, datetime]) -> datetime:
+    """Parse a CBEvent timestamp, reusing earlier results stored in ``ts_cache``."""
+    parsed = ts_cache.get(ts)
+    if parsed is None:
+        parsed = ts_cache[ts] = _parse_ts(ts)
+    return parsed
+
+
+def _join_payload(prefix: bytes, payload_dict: Dict[str, Any]) -> bytes:
+    """Join a trace prefix from ``_build_payload_prefix`` with the event fields from ``_build_payload``.
+
+    The event fields are never empty, so the prefix's trailing comma is always followed by a field.
+    """
+    tail = orjson.dumps(payload_dict, default=str, option=orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS)
+    return prefix + tail[1:]
+
+
+# Cleared the first time the batch endpoint answers 404/405; every worker then posts events one at a time
+_batch_supported = True
+
+
+class _EventLogWorker:
+    """Background thread that batches logging payloads and posts them to MongoDB.
+
+    Kept apart from ``TrustwiseCallbackHandler`` so the thread never references the handler,
+    which can then be garbage collected; the thread is only started by the first payload.
+    """
+
+    _JSON_HEADERS = {"Content-Type": "application/json"}
+
+    def __init__(self, batch_size: int, flush_ms: int) -> None:
+        # Pooled keep-alive session so events reuse connections instead of a new handshake each.
+        # Only failures where the batch cannot have been stored are retried, inside the adapter on
+        # the log worker thread: connection errors and 502/503 from a proxy or an overloaded server,
+        # waiting as long as its Retry-After asks. Read errors, 500 and 504 are not retried: the
+        # server may already have stored the batch, and it has no batch key to de-duplicate a resend.
+        self._log_url = TW_LOG_EVENTS_BATCH_URL
+        self._fallback_url = TW_LOG_EVENTS_URL  # Used one event at a time if the batch endpoint is missing
+        self._session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=10,
+            pool_maxsize=20,
+            max_retries=Retry(
+                total=3,
+                connect=2,
+                read=0,
+                backoff_factor=0.25,
+                backoff_jitter=0.1,
+                status_forcelist=(502, 503),
+                allowed_methods=frozenset(["POST"]),
+                respect_retry_after_header=True,
+            ),
+        )
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+
+        self._log_queue: queue.Queue = queue.Queue(maxsize=10000)
+        self._batch_size = batch_size
+        self._flush_secs = flush_ms / 1000
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._discard = False  # Set when close() timed out; whatever is still queued is dropped
+        self.closed = False
+        self.dropped_events = 0  # Events that could not be serialized
+
+    def _post(self, url: str, body: bytes) -> None:
+        response = self._session.post(url=url, data=body, headers=self._JSON_HEADERS, timeout=(3, 10))
+        response.raise_for_status()  # Raise HTTPError for bad responses
+
+    def _post_batch(self, batch: List[Tuple[bytes, Dict[str, Any]]]) -> None:
+        """Send a batch of (prefix, event fields) payloads to MongoDB. Runs on the log worker thread."""
+        global _batch_supported
+        if not batch:
+            return
+
+        try:
+            # Only the event fields are serialized (with orjson, str() for anything it can't encode);
+            # each trace's constant prefix is reused as is. An event orjson still rejects is dropped alone.
+            bodies = []
+            for prefix, payload_dict in batch:
+                try:
+                    bodies.append(_join_payload(prefix, payload_dict))
+                except orjson.JSONEncodeError as e:
+                    self.dropped_events += 1
+                    logger.error(f"Could not serialize event, dropping it - {payload_dict.get('event_id')}: {e}")
+            if not bodies:
+                return
+
+            if _batch_supported:
+                try:
+                    self._post(self._log_url, b'{"events":[' + b",".join(bodies) + b"]}")
+                    logger.info(f"{len(bodies)} events logged to MongoDB Successfully")
+                    return
+                except requests.exceptions.HTTPError as e:
+                    if e.response is None or e.response.status_code not in (404, 405):
+                        raise
+                    logger.warning("Batch log endpoint is not available, logging events one at a time")
+                    _batch_supported = False
+
+            logged = 0
+            for body in bodies:
+                if self._discard:
+                    return
+                try:
+                    self._post(self._fallback_url, body)
+                except requests.exceptions.RequestException as e:  # Skip this event, keep sending the rest
+                    logger.error(f"Error logging event to MongoDB: {e}")
+                    continue
+                logged += 1
+            logger.info(f"{logged} events logged to MongoDB Successfully")
+
+        except requests.exceptions.RequestException as e:  # Handle request exceptions
+            logger.error(f"Error logging events to MongoDB: {e}")
+
+        except Exception as e:
+            logger.error(f"Unexpected error: {e}")  # Handle Unexpected Errors
+
+    def _run(self) -> None:
+        """Batch queued payloads until the stop sentinel is received.
+
+        A batch is sent once it holds ``batch_size`` events, once its oldest event has
+        waited ``flush_ms``, or when a flush is requested.
+        """
+        batch: List[Tuple[bytes, Dict[str, Any]]] = []
+        flush_at: Optional[float] = None
+        while not self._discard:
+            if flush_at is not None:
+                timeout: Optional[float] = max(flush_at - time.monotonic(), 0.0)
+            else:
+                # Once stopped, keep polling so the worker exits after the queue is drained
+                timeout = self._flush_secs if self.closed else None
+            try:
+                item = self._log_queue.get(timeout=timeout)
+            except queue.Empty:  # Oldest event in the batch has waited long enough
+                self._post_batch(batch)
+                batch, flush_at = [], None
+                if self.closed:
+                    break
+                continue
+
+            if isinstance(item, threading.Event) or item is _STOP:  # Flush request or stop sentinel
+                self._post_batch(batch)
+                batch, flush_at = [], None
+                if item is _STOP:
+                    break
+                item.set()
+                continue
+
+            batch.append(item)
+            if flush_at is None:
+                flush_at = time.monotonic() + self._flush_secs
+            if len(batch) >= self._batch_size:
+                self._post_batch(batch)
+                batch, flush_at = [], None
+
+        self._session.close()
+
+    def put(self, item: Tuple[bytes, Dict[str, Any]]) -> None:
+        """Queue a payload, starting the worker thread on first use. Raises ``queue.Full``."""
+        if self.closed:
+            return
+
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="tw-log", daemon=True)
+                    self._thread.start()
+                    _log_workers.add(self)
+        self._log_queue.put_nowait(item)
+
+    def flush(self, wait: bool = True, timeout: Optional[float] = _DRAIN_TIMEOUT_SECS) -> bool:
+        """Send the current batch now.
+
+        With ``wait``, block until every event queued before the call is sent, for at most
+        ``timeout`` seconds. Returns False if that did not happen in time.
+        """
+        if self.closed or self._thread is None or not self._thread.is_alive():
+            return True  # Once closed, close() sends what is left, or drops it (with a warning)
+
+        flushed = threading.Event()  # Set by the worker once it reaches this request
+        if not wait:
+            try:
+                self._log_queue.put_nowait(flushed)
+            except queue.Full:
+                pass  # The worker is busy sending full batches; the tail goes out after flush_ms
+            return True
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            self._log_queue.put(flushed, timeout=timeout)
+        except queue.Full:
+            return False
+        return flushed.wait(None if deadline is None else max(deadline - time.monotonic(), 0.0))
+
+    def stop(self) -> None:
+        """Stop accepting payloads; the thread exits once the queued ones are sent. Does not block."""
+        self.closed = True
+        if self._thread is None:
+            self._session.close()
+            return
+
+        try:
+            self._log_queue.put_nowait(_STOP)
+        except queue.Full:
+            pass  # The worker notices closed once it has drained the queue
+
+    def close(self, timeout: Optional[float] = _DRAIN_TIMEOUT_SECS) -> None:
+        """Stop the worker and wait up to ``timeout`` seconds for pending payloads to be sent.
+
+        Payloads still queued after the timeout are dropped.
+        """
+        self.stop()
+        if self._thread is None:
+            return
+
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            self._discard = True
+            with self._log_queue.mutex:  # Count the payloads only, not the stop sentinel or flush requests
+                pending = sum(1 for item in self._log_queue.queue if isinstance(item, tuple))
+            logger.warning(f"Dropping event logs not sent within {timeout:g} seconds - {pending} queued")
+
+
+_log_workers: "weakref.WeakSet[_EventLogWorker]" = weakref.WeakSet()  # Workers with a running thread
+
+
+def _close_log_workers(timeout: float = _DRAIN_TIMEOUT_SECS) -> None:
+    """Send the pending event logs of every running worker before the interpreter exits.
+
+    All workers share one ``timeout`` so a slow or unreachable endpoint can't hold up exit.
+    """
+    deadline = time.monotonic() + timeout
+    for worker in list(_log_workers):
+        worker.close(max(deadline - time.monotonic(), 0.0))
+
+
+atexit.register(_close_log_workers)
+
 
 # TODO Refactor the callback to inherit from BaseCallback from Llama Index
 # TODO Refactor to remove redundant functionalities copied from Llama Debug
@@ -29,17 +289,46 @@ class TrustwiseCallbackHandler(BaseCallbackHandler):
         may change.
 
         This handler keeps track and logs of event starts/ends, separated by event types.
-        Generates an Experiment ID to track evaluations and pipeline events under one umbrella.
+        Tags every logged event with the caller's scan ID to track evaluations and pipeline
+        events under one umbrella.
         Uploads the logs to MongoDB - part of the Safety System of Record.
 
         Args:
+            user_id (str): Trustwise user ID the events are logged under.
+            scan_name (str): human readable name of the scan.
+            scan_id (str): ID grouping the events and evaluations of one scan.
+            project_id (Optional[str]): project the scan belongs to.
             event_starts_to_ignore (Optional[List[CBEventType]]): list of event types to
                 ignore when tracking event starts.
             event_ends_to_ignore (Optional[List[CBEventType]]): list of event types to
                 ignore when tracking event ends.
+            batch_size (int): maximum number of events sent to MongoDB in a single request.
+            flush_ms (int): maximum time in milliseconds an event waits in a batch before it is sent.
+            max_event_history (Optional[int]): number of most recent events kept in memory;
+                older events are forgotten, including by ID. Unbounded if None.
 
         """
 
+    # BaseCallbackHandler has no __slots__, so its own attributes still live in __dict__
+    __slots__ = (
+        "user_id",
+        "scan_name",
+        "scan_id",
+        "project_id",
+        "_event_pairs_by_id",
+        "_sequential_events",
+        "_event_monotonic",
+        "_cur_trace_id",
+        "_trace_map",
+        "print_trace_on_end",
+        "_logging_enabled",
+        "_payload_prefix",
+        "_dropped_events",
+        "_log_worker",
+    )
+
+    _payload_serializer_cache: Dict[type, Callable[[Any], Any]] = {}  # Shared by all handlers
+
     def __init__(
             self,
             user_id: str,
@@ -49,18 +338,33 @@ class TrustwiseCallbackHandler(BaseCallbackHandler):
             event_starts_to_ignore: Optional[List[CBEventType]] = None,
             event_ends_to_ignore: Optional[List[CBEventType]] = None,
             print_trace_on_end: bool = True,
+            batch_size: int = 32,
+            flush_ms: int = 200,
+            max_event_history: Optional[int] = None,
     ) -> None:
         """Initialize the Trustwise Callback handler."""
+        if max_event_history is not None and max_event_history < 1:
+            raise ValueError("max_event_history must be a positive integer or None")
+
         self.user_id = user_id
         self.scan_name = scan_name
         self.scan_id = scan_id
         self.project_id = project_id
-        self._event_pairs_by_type: Dict[CBEventType, List[CBEvent]] = defaultdict(list)
-        self._event_pairs_by_id: Dict[str, List[CBEvent]] = defaultdict(list)
-        self._sequential_events: List[CBEvent] = []
+        self._event_pairs_by_id: Dict[str, List[CBEvent]] = {}
+        self._sequential_events: Deque[CBEvent] = deque(maxlen=max_event_history)
+        self._event_monotonic: Dict[str, List[float]] = {}  # Monotonic start/end times by event ID
         self._cur_trace_id: Optional[str] = None
         self._trace_map: Dict[str, List[str]] = defaultdict(list)
         self.print_trace_on_end = print_trace_on_end
+        self._logging_enabled = True
+        self._payload_prefix = self._build_payload_prefix()
+
+        # Events are posted by a background worker so callbacks never wait on the network.
+        # The worker holds no reference back to the handler, and stops once the handler is collected.
+        self._dropped_events = 0
+        self._log_worker = _EventLogWorker(batch_size=batch_size, flush_ms=flush_ms)
+        weakref.finalize(self, self._log_worker.stop).atexit = False  # _close_log_workers drains at exit
+
         event_starts_to_ignore = (
             event_starts_to_ignore if event_starts_to_ignore else []
         )
@@ -88,9 +392,7 @@ class TrustwiseCallbackHandler(BaseCallbackHandler):
 
         """
         event = CBEvent(event_type, payload=payload, id_=event_id)
-        self._event_pairs_by_type[event.event_type].append(event)
-        self._event_pairs_by_id[event.id_].append(event)
-        self._sequential_events.append(event)
+        self._record_event(event)
 
         # Log event to MongoDB
         self.log_to_mongodb(event, parent_id)
@@ -113,75 +415,176 @@ class TrustwiseCallbackHandler(BaseCallbackHandler):
 
         """
         event = CBEvent(event_type, payload=payload, id_=event_id)
-        self._event_pairs_by_type[event.event_type].append(event)
-        self._event_pairs_by_id[event.id_].append(event)
-        self._sequential_events.append(event)
+        self._record_event(event)
 
         self.log_to_mongodb(event)  # Log events to MongoDB
 
-        self._trace_map = defaultdict(list)
+    def _record_event(self, event: CBEvent) -> None:
+        """Store an event in order, by ID, and with its monotonic time stamp."""
+        if len(self._sequential_events) == self._sequential_events.maxlen:
+            # The deque is about to drop its oldest event, which is also the first one stored for its ID
+            oldest_id = self._sequential_events[0].id_
+            if len(self._event_pairs_by_id[oldest_id]) == 1:
+                del self._event_pairs_by_id[oldest_id]
+                del self._event_monotonic[oldest_id]
+            else:
+                del self._event_pairs_by_id[oldest_id][0]
+                del self._event_monotonic[oldest_id][0]
+        self._sequential_events.append(event)
+        now = time.monotonic()
+        event_pair = self._event_pairs_by_id.get(event.id_)
+        if event_pair is None:  # First event for this ID
+            self._event_pairs_by_id[event.id_] = [event]
+            self._event_monotonic[event.id_] = [now]
+        else:
+            event_pair.append(event)
+            self._event_monotonic[event.id_].append(now)
 
     # Function to log events to MongoDB
     def log_to_mongodb(self, event: CBEvent, parent_id: str = "") -> None:
-        """
+        """Queue an event to be logged to MongoDB by the background worker.
+
+        Nothing is logged when ``logging_enabled`` is off, after ``close()``, or when the
+        handler has no ``user_id``, since the endpoint would reject the event anyway. The
+        event is dropped (and counted in ``dropped_events``) if the queue is full, or by the
+        worker if it cannot be serialized.
 
         :param event: Callback Event from Llama Index to be stored in the logs
         :param parent_id: Parent event ID, if the event is a parent then 'root'
         :return:
         """
-        try:
-            payload = LoggingPayload(
-                user_id=self.user_id,
-                scan_name=self.scan_name,
-                scan_id=self.scan_id,
-                project_id=self.project_id,
-                trace_type=self._cur_trace_id,
-                event_type=event.event_type.name,
-                parent_id=parent_id if parent_id else event.id_,
-                event_id=event.id_,
-                event_time=event.time,
-                event_payload=event.payload.to_dict() if hasattr(event.payload, 'to_dict') else str(event.payload),
-            )
-
-            payload_dict = payload.model_dump()  # Convert to dict for JSON serialization
-            response = requests.post(url=TW_LOG_EVENTS_URL, json=payload_dict)
-            response.raise_for_status()  # Raise HTTPError for bad responses
-
-            logger.info(f"Event logged to MongoDB Successfully - {event.id_}")
-
-        except requests.exceptions.RequestException as e:  # Handle request exceptions
-            logger.error(f"Error logging event to MongoDB: {e}")
+        if not self._logging_enabled or not self.user_id or self._log_worker.closed:
+            return
 
+        try:
+            payload_dict = self._build_payload(event, parent_id)
         except Exception as e:
             logger.error(f"Unexpected error: {e}")  # Handle Unexpected Errors
+            return
+
+        try:
+            self._log_worker.put((self._payload_prefix, payload_dict))
+        except queue.Full:
+            self._dropped_events += 1
+            logger.warning(f"Event log queue is full, dropping event - {event.id_}")
+
+    def _build_payload_prefix(self) -> bytes:
+        """Serialize the ``LoggingPayload`` fields that stay constant for a trace.
+
+        Returns the JSON object without its closing brace, ready to be joined with the
+        serialized event fields from ``_build_payload``.
+        """
+        prefix = orjson.dumps({
+            "user_id": self.user_id,
+            "scan_id": self.scan_id,
+            "project_id": self.project_id,
+            "scan_name": self.scan_name,
+            "trace_type": self._cur_trace_id,
+        })
+        return prefix[:-1] + b","
+
+    def _build_payload(self, event: CBEvent, parent_id: str = "") -> Dict[str, Any]:
+        """Build the JSON-serializable, per-event part of the logging payload.
+
+        Together with ``_payload_prefix`` the dict follows the ``LoggingPayload`` schema but
+        is built directly, skipping model construction on the hot path. It is only validated
+        against the model when debug logging is enabled.
+        """
+        payload_dict = {
+            "event_type": event.event_type.name,
+            "parent_id": parent_id if parent_id else event.id_,
+            "event_id": event.id_,
+            "event_time": event.time,
+            "event_payload": self._serialize_payload(event.payload),
+        }
+
+        if logger.isEnabledFor(logging.DEBUG):
+            try:
+                LoggingPayload.model_validate(orjson.loads(_join_payload(self._payload_prefix, payload_dict)))
+            except ValidationError as e:
+                logger.debug(f"Event payload does not match LoggingPayload - {event.id_}: {e}")
+
+        return payload_dict
+
+    def _serialize_payload(self, payload: Any) -> Any:
+        """Convert an event payload for logging, resolving how to do so once per payload type."""
+        payload_type = type(payload)
+        serializer = self._payload_serializer_cache.get(payload_type)
+        if serializer is None:
+            serializer = operator.methodcaller("to_dict") if hasattr(payload_type, "to_dict") else str
+            self._payload_serializer_cache[payload_type] = serializer
+        return serializer(payload)
+
+    def flush(self, wait: bool = True, timeout: Optional[float] = _DRAIN_TIMEOUT_SECS) -> None:
+        """Send any batched event logs to MongoDB now.
+
+        Args:
+            wait (bool): block until every event queued so far has been sent.
+            timeout (Optional[float]): maximum seconds to wait; None waits indefinitely.
+
+        """
+        if not self._log_worker.flush(wait, timeout):
+            logger.warning(f"Event logs were not sent within {timeout} seconds")
+
+    def close(self, timeout: Optional[float] = _DRAIN_TIMEOUT_SECS) -> None:
+        """Send any pending event logs and stop logging events for this handler.
+
+        Args:
+            timeout (Optional[float]): maximum seconds to wait for pending event logs; those
+                still unsent afterwards are dropped. None waits indefinitely.
+
+        """
+        self._log_worker.close(timeout)
+
+    async def aflush(self, timeout: Optional[float] = _DRAIN_TIMEOUT_SECS) -> None:
+        """Async version of ``flush`` that waits without blocking the running event loop."""
+        await asyncio.get_running_loop().run_in_executor(None, self.flush, True, timeout)
+
+    async def aclose(self, timeout: Optional[float] = _DRAIN_TIMEOUT_SECS) -> None:
+        """Async version of ``close`` that waits without blocking the running event loop."""
+        await asyncio.get_running_loop().run_in_executor(None, self.close, timeout)
 
     def get_events(self, event_type: Optional[CBEventType] = None) -> List[CBEvent]:
         """Get all events for a specific event type."""
         if event_type is not None:
-            return self._event_pairs_by_type[event_type]
+            return [event for event in self._sequential_events if event.event_type == event_type]
 
-        return self._sequential_events
+        return list(self._sequential_events)
 
-    def _get_event_pairs(self, events: List[CBEvent]) -> List[List[CBEvent]]:
-        """Helper function to pair events according to their ID."""
+    def _get_event_pairs(
+            self, events: Sequence[CBEvent], ts_cache: Optional[Dict[str, datetime]] = None
+    ) -> List[List[CBEvent]]:
+        """Helper function to pair events according to their ID.
+
+        ``ts_cache`` maps timestamps to parsed datetimes and can be shared with
+        ``_get_time_stats_from_event_pairs`` so each timestamp is parsed only once.
+        """
         event_pairs: Dict[str, List[CBEvent]] = defaultdict(list)
         for event in events:
             event_pairs[event.id_].append(event)
 
-        return sorted(
-            event_pairs.values(),
-            key=lambda x: datetime.strptime(x[0].time, TIMESTAMP_FORMAT),
-        )
+        # Sort on keys computed once per pair, using the monotonic start stamps when every pair has them
+        event_monotonic = self._event_monotonic
+        if all(event_id in event_monotonic for event_id in event_pairs):
+            decorated = [(event_monotonic[event_id][0], pair) for event_id, pair in event_pairs.items()]
+        else:
+            # Monotonic stamps can't be compared with wall-clock times, so parse every start time
+            if ts_cache is None:
+                ts_cache = {}
+            decorated = [(_parse_ts_cached(pair[0].time, ts_cache), pair) for pair in event_pairs.values()]
+
+        decorated.sort(key=operator.itemgetter(0))
+        return [pair for _, pair in decorated]
 
     def _get_time_stats_from_event_pairs(
-            self, event_pairs: List[List[CBEvent]]
+            self, event_pairs: List[List[CBEvent]], ts_cache: Optional[Dict[str, datetime]] = None
     ) -> EventStats:
         """Calculate time-based stats for a set of event pairs."""
+        if ts_cache is None:
+            ts_cache = {}
         total_secs = 0.0
         for event_pair in event_pairs:
-            start_time = datetime.strptime(event_pair[0].time, TIMESTAMP_FORMAT)
-            end_time = datetime.strptime(event_pair[-1].time, TIMESTAMP_FORMAT)
-            total_secs += (end_time - start_time).total_seconds()
+            total_secs += self._get_event_pair_secs(event_pair, ts_cache)
 
         return EventStats(
             total_secs=total_secs,
@@ -189,35 +592,47 @@ class TrustwiseCallbackHandler(BaseCallbackHandler):
             total_count=len(event_pairs),
         )
 
+    def _get_event_pair_secs(self, event_pair: List[CBEvent], ts_cache: Dict[str, datetime]) -> float:
+        """Seconds between the start and end of an event pair."""
+        stamps = self._event_monotonic.get(event_pair[0].id_)
+        if stamps:
+            return stamps[-1] - stamps[0]
+
+        # Events not recorded by this handler only carry their timestamp strings
+        start_time = _parse_ts_cached(event_pair[0].time, ts_cache)
+        end_time = _parse_ts_cached(event_pair[-1].time, ts_cache)
+        return (end_time - start_time).total_seconds()
+
     def get_event_pairs(
             self, event_type: Optional[CBEventType] = None
     ) -> List[List[CBEvent]]:
         """Pair events by ID, either all events or a specific type."""
-        if event_type is not None:
-            return self._get_event_pairs(self._event_pairs_by_type[event_type])
-
-        return self._get_event_pairs(self._sequential_events)
+        return self._get_event_pairs(self.get_events(event_type))
 
     def get_llm_inputs_outputs(self) -> List[List[CBEvent]]:
         """Get the exact LLM inputs and outputs."""
-        return self._get_event_pairs(self._event_pairs_by_type[CBEventType.LLM])
+        return self.get_event_pairs(CBEventType.LLM)
 
     def get_event_time_info(
             self, event_type: Optional[CBEventType] = None
     ) -> EventStats:
-        event_pairs = self.get_event_pairs(event_type)
-        return self._get_time_stats_from_event_pairs(event_pairs)
+        events = self.get_events(event_type)
+        ts_cache: Dict[str, datetime] = {}  # Shared so start times are not parsed again for the stats
+        event_pairs = self._get_event_pairs(events, ts_cache)
+        return self._get_time_stats_from_event_pairs(event_pairs, ts_cache)
 
     def flush_event_logs(self) -> None:
         """Clear all events from memory."""
-        self._event_pairs_by_type = defaultdict(list)
-        self._event_pairs_by_id = defaultdict(list)
-        self._sequential_events = []
+        self.flush(wait=False)
+        self._event_pairs_by_id = {}
+        self._sequential_events.clear()
+        self._event_monotonic = {}
 
     def start_trace(self, trace_id: Optional[str] = None) -> None:
         """Launch a trace."""
         self._trace_map = defaultdict(list)
         self._cur_trace_id = trace_id
+        self._payload_prefix = self._build_payload_prefix()
 
     def end_trace(
             self,
@@ -226,24 +641,28 @@ class TrustwiseCallbackHandler(BaseCallbackHandler):
     ) -> None:
         """Shutdown the current trace."""
         self._trace_map = trace_map or defaultdict(list)
+        self.flush(wait=False)
         if self.print_trace_on_end:
             self.print_trace_map()
 
     def _print_trace_map(self, cur_event_id: str, level: int = 0) -> None:
-        """Recursively print trace map to terminal for debugging."""
-        event_pair = self._event_pairs_by_id[cur_event_id]
-        if event_pair:
-            time_stats = self._get_time_stats_from_event_pairs([event_pair])
-            indent = " " * level * 2
-            print(
-                f"{indent}|_{event_pair[0].event_type} -> ",
-                f"{time_stats.total_secs} seconds",
-                flush=True,
-            )
-
-        child_event_ids = self._trace_map[cur_event_id]
-        for child_event_id in child_event_ids:
-            self._print_trace_map(child_event_id, level=level + 1)
+        """Print trace map to terminal for debugging, walking it depth first with a stack."""
+        ts_cache: Dict[str, datetime] = {}
+        stack = [(cur_event_id, level)]
+        while stack:
+            event_id, level = stack.pop()
+            event_pair = self._event_pairs_by_id.get(event_id)
+            if event_pair:
+                indent = " " * level * 2
+                print(
+                    f"{indent}|_{event_pair[0].event_type} -> ",
+                    f"{self._get_event_pair_secs(event_pair, ts_cache)} seconds",
+                    flush=True,
+                )
+
+            # Reversed so children are popped, and printed, in their original order
+            child_event_ids = self._trace_map.get(event_id, ())
+            stack.extend((child_event_id, level + 1) for child_event_id in reversed(child_event_ids))
 
     def print_trace_map(self) -> None:
         """Print simple trace map to terminal for debugging of the most recent trace."""
@@ -254,12 +673,29 @@ class TrustwiseCallbackHandler(BaseCallbackHandler):
 
     @property
     def event_pairs_by_type(self) -> Dict[CBEventType, List[CBEvent]]:
-        return self._event_pairs_by_type
+        """Events grouped by type, built on demand from ``sequential_events``."""
+        event_pairs_by_type: Dict[CBEventType, List[CBEvent]] = defaultdict(list)
+        for event in self._sequential_events:
+            event_pairs_by_type[event.event_type].append(event)
+        return event_pairs_by_type
 
     @property
     def events_pairs_by_id(self) -> Dict[str, List[CBEvent]]:
         return self._event_pairs_by_id
 
+    @property
+    def logging_enabled(self) -> bool:
+        return self._logging_enabled
+
+    @logging_enabled.setter
+    def logging_enabled(self, enabled: bool) -> None:
+        """Turn logging of events to MongoDB on or off; events are still tracked in memory."""
+        self._logging_enabled = enabled
+
+    @property
+    def dropped_events(self) -> int:
+        return self._dropped_events + self._log_worker.dropped_events
+
     @property
     def sequential_events(self) -> List[CBEvent]:
-        return self._sequential_events
+        return list(self._sequential_events)
@@ -1,5 +1,6 @@
 # Log events to DataStore
 TW_LOG_EVENTS_URL = "http://api.trustwise.ai/safety/v2/log_event"
+TW_LOG_EVENTS_BATCH_URL = "http://api.trustwise.ai/safety/v2/log_event/batch"
 
 # Evaluation Endpoint
 TW_EVALUATION_URL = "http://api.trustwise.ai/safety/v2/evaluate"
\ No newline at end of file
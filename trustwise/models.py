@@ -1,4 +1,4 @@
-from typing import List, Optional
+from typing import Any, Dict, List, Optional, Union
 
 from pydantic import BaseModel
 
@@ -23,11 +23,11 @@ class UploadData(BaseModel):  # Pydantic Model for data uploaded to the Evaluati
 class LoggingPayload(BaseModel):  # Pydantic Model for Events Data to be logged to MongoDB
     user_id: str
     scan_id: str
-    project_id: str
+    project_id: Optional[str] = None
     scan_name: str
-    trace_type: str
+    trace_type: Optional[str] = None  # None for events logged before a trace starts
     event_type: str
     parent_id: Optional[str] = ""
     event_id: str
     event_time: str
-    event_payload: str
+    event_payload: Union[str, Dict[str, Any]]  # to_dict() of the payload when available, else str()